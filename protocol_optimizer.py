@@ -9,25 +9,117 @@ import os
 import json
 import re
 import time
+import hashlib
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
 from datetime import datetime
+from operator import attrgetter
 import argparse
 import sys
 
-# Install required packages: pip install requests beautifulsoup4 pandas
+# Install required packages: pip install -r requirements.txt
+# Optional speedups: pip install diskcache orjson
 
 try:
-    import pandas as pd
-    from bs4 import BeautifulSoup
+    import diskcache
 except ImportError:
-    print("Installing required packages...")
-    os.system("pip install requests beautifulsoup4 pandas")
-    import pandas as pd
-    from bs4 import BeautifulSoup
+    diskcache = None  # Optional: persistent response cache
 
-@dataclass
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Optional: faster JSON encoding/decoding
+
+CACHE_DIR = os.path.expanduser("~/.cache/protocol_optimizer")
+CACHE_EXPIRE = 7 * 86400  # Seconds a cached Gemini response stays valid
+CACHE_VERSION = 2  # Bump when the prompts or response format change so old entries miss
+MEMO_SIZE = 256  # Parsed Gemini results kept in memory per GeminiOptimizer
+SCAN_CACHE_SIZE = 1024  # Keyword scan results kept per ProtocolDatabase
+SCAN_CACHE_MAX_CHARS = 16384  # Longer texts are scanned every time instead of being held as keys
+MODEL_MAX_OUTPUT_TOKENS = 2048  # Documented output limit of gemini-pro per request
+MAX_OUTPUT_TOKENS = 800  # Five parsed optimizations at ~120 tokens each, plus headroom
+MAX_BATCH_SIZE = MODEL_MAX_OUTPUT_TOKENS // MAX_OUTPUT_TOKENS  # Protocols whose answers fit one response
+
+# Static prompt text shared by single and batched requests; kept flush-left
+# because indentation inside the prompt is billed as input tokens
+_PROMPT_FOCUS = """3-5 specific, actionable optimizations focusing on:
+1. Cost reduction (cheaper alternatives, volume reduction, bulk purchasing)
+2. Time reduction (faster methods, parallel processing, automation)
+3. Efficiency improvements (better yields, reduced errors, simplified steps)
+4. Equipment alternatives (cheaper/more available instruments)"""
+
+_PROMPT_FORMAT = """TYPE: [Cost Reduction|Time Reduction|Efficiency|Equipment]
+SUGGESTION: [Specific actionable recommendation]
+SAVINGS: [Quantified benefit]
+CONFIDENCE: [0.1-1.0 confidence score]
+REASONING: [Brief scientific justification]
+---
+
+Be specific with numbers, brands, and techniques. Focus on practical, immediately implementable changes."""
+
+# Precompiled patterns for parsing Gemini responses
+_TYPE_RE = re.compile(r'TYPE:\s*(.+)', re.IGNORECASE)
+_SUG_RE = re.compile(r'SUGGESTION:\s*(.+)', re.IGNORECASE | re.DOTALL)
+_SAV_RE = re.compile(r'SAVINGS:\s*(.+)', re.IGNORECASE)
+_CONF_RE = re.compile(r'CONFIDENCE:\s*([\d.]+)', re.IGNORECASE)
+_STRIP_SAV_RE = re.compile(r'SAVINGS:.*', re.IGNORECASE | re.DOTALL)
+_BATCH_SPLIT_RE = re.compile(r'===\s*PROT\s*(\d+)\s*===', re.IGNORECASE)
+
+_COST_RES = tuple(re.compile(pattern) for pattern in (
+    r'(\d+)%.*cost.*reduction',
+    r'(\d+)%.*cheaper',
+    r'save.*(\d+)%.*cost',
+    r'reduce.*cost.*(\d+)%'
+))
+
+_TIME_RES = tuple(re.compile(pattern) for pattern in (
+    r'(\d+)%.*time.*reduction',
+    r'(\d+)%.*faster',
+    r'save.*(\d+)%.*time',
+    r'reduce.*time.*(\d+)%'
+))
+
+# Piped stdin protocol blocks: one 'KEY: value' per line, TITLE starts a protocol
+_BLOCK_RE = re.compile(r'^(TITLE|DESC|MATERIAL|CONSTRAINTS):[ \t]*(.*)$', re.MULTILINE)
+
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode()
+
+def _json_loads(data):
+    """Parse JSON from str or bytes, with orjson when available"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+class _LRUCache:
+    """Small per-instance LRU map; unlike functools.lru_cache it does not pin its owner"""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+    
+    def get(self, key):
+        """Return the cached value and mark it recently used, or None on a miss"""
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+@dataclass(frozen=True, slots=True)
 class Optimization:
     """Represents a protocol optimization suggestion"""
     type: str
@@ -37,8 +129,13 @@ class Optimization:
     source: str
     estimated_cost_reduction: float = 0.0
     estimated_time_reduction: float = 0.0
+    
+    def __post_init__(self):
+        # Types and sources come from a tiny vocabulary; share one string object each
+        object.__setattr__(self, 'type', sys.intern(self.type))
+        object.__setattr__(self, 'source', sys.intern(self.source))
 
-@dataclass
+@dataclass(slots=True)
 class Protocol:
     """Represents a lab protocol"""
     title: str
@@ -48,6 +145,11 @@ class Protocol:
     estimated_cost: float = 0.0
     estimated_time: float = 0.0
     constraints: str = ""
+    search_text: str = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Lowercased keyword-scan text, built once per protocol
+        self.search_text = f"{self.title} {self.description} {' '.join(self.materials)}".lower()
 
 class ProtocolDatabase:
     """Mock database simulating protocol repositories"""
@@ -161,143 +263,366 @@ class ProtocolDatabase:
                 ]
             }
         }
-
-    def get_optimizations(self, protocol_text: str) -> List[Dict]:
-        """Get optimizations based on protocol content"""
-        protocol_text_lower = protocol_text.lower()
-        found_optimizations = []
         
-        for protocol_type, data in self.protocols.items():
-            # Check if any keywords match
-            if any(keyword in protocol_text_lower for keyword in data['keywords']):
-                found_optimizations.extend(data['optimizations'])
+        # Keyword tuples per category, scanned with str.__contains__ (a C-level
+        # substring search that beats a regex alternation for this keyword set)
+        self._cat_keywords: Dict[str, Tuple[str, ...]] = {
+            cat: tuple(d['keywords']) for cat, d in self.protocols.items()
+        }
+        
+        # Frozen Optimization objects are built once and shared across lookups
+        self._cat_opts: Dict[str, Tuple[Optimization, ...]] = {
+            cat: tuple(
+                Optimization(
+                    type=o['type'],
+                    suggestion=o['suggestion'],
+                    savings=o['savings'],
+                    confidence=o['confidence'],
+                    source=o['source'],
+                    estimated_cost_reduction=o['cost_reduction'],
+                    estimated_time_reduction=o['time_reduction']
+                )
+                for o in d['optimizations']
+            )
+            for cat, d in self.protocols.items()
+        }
         
-        return found_optimizations
+        # Memoized scan results for repeated protocol texts
+        self._scan_cache = _LRUCache(SCAN_CACHE_SIZE)
+
+    def get_optimizations(self, text_lower: str) -> List[Optimization]:
+        """Get optimizations based on already-lowercased protocol content"""
+        cacheable = len(text_lower) <= SCAN_CACHE_MAX_CHARS
+        categories = self._scan_cache.get(text_lower) if cacheable else None
+        if categories is None:
+            categories = self._scan_categories(text_lower)
+            if cacheable:
+                self._scan_cache.put(text_lower, categories)
+        
+        return list(itertools.chain.from_iterable(
+            self._cat_opts[cat] for cat in categories
+        ))
+    
+    def _scan_categories(self, text_lower: str) -> Tuple[str, ...]:
+        """Return matching categories in database order"""
+        return tuple(
+            cat for cat, keywords in self._cat_keywords.items()
+            if any(kw in text_lower for kw in keywords)
+        )
 
 class GeminiOptimizer:
     """Interface to Gemini API for protocol optimization"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache_dir: Optional[str] = CACHE_DIR):
         self.api_key = api_key
         self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+        self.stream_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:streamGenerateContent"
+        
+        # Reuse one keep-alive connection pool across API calls
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            # Retry throttling and server errors, plus connections that never
+            # reached the server; a POST that was sent is not replayed on a read
+            # error, and the last error response is returned for _generate to report
+            max_retries=Retry(
+                total=3,
+                read=0,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(["POST"]),
+                raise_on_status=False
+            )
+        ))
+        self._session.headers.update({"Content-Type": "application/json"})
+        
+        # Parsed results for this process, keyed on the protocol hash
+        self._memo = _LRUCache(MEMO_SIZE)
+        
+        # Responses persist across runs when diskcache is installed
+        self._disk_cache = diskcache.Cache(cache_dir) if diskcache and cache_dir else None
+    
+    def close(self):
+        """Release pooled HTTP connections and the response cache"""
+        self._session.close()
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+    
+    @staticmethod
+    def _cache_key(protocol: Protocol, batched: bool = False) -> str:
+        """Hash the protocol fields and prompt variant that determine the Gemini response"""
+        payload = json.dumps({
+            'version': CACHE_VERSION,
+            'batched': batched,
+            'title': protocol.title,
+            'description': protocol.description,
+            'materials': protocol.materials,
+            'constraints': protocol.constraints
+        }, sort_keys=True)
+        return hashlib.blake2b(payload.encode()).hexdigest()
     
     def optimize_protocol(self, protocol: Protocol) -> List[Optimization]:
         """Get optimization suggestions from Gemini API"""
+        return list(self.stream_protocol(protocol))
+    
+    def stream_protocol(self, protocol: Protocol) -> Iterator[Optimization]:
+        """Yield Gemini optimizations as each response section arrives"""
+        key = self._cache_key(protocol)
+        optimizations = self._lookup(key)
+        if optimizations is not None:
+            yield from optimizations
+            return
+        
+        sections = []
+        optimizations = []
+        stream = self._iter_sections(self._build_prompt(protocol))
+        try:
+            for section in stream:
+                optimization = self._parse_gemini_response_section(section)
+                if optimization:
+                    sections.append(section)
+                    optimizations.append(optimization)
+                    yield optimization
+                    if len(optimizations) == 5:  # Limit to 5 optimizations
+                        break
+        except Exception as e:
+            print(f"Warning: Gemini API error: {e}")
+            return
+        finally:
+            stream.close()
         
-        prompt = f"""
-        As an expert lab protocol optimizer, analyze this protocol and provide specific optimizations:
+        self._store(key, '---'.join(sections), tuple(optimizations))
+    
+    @staticmethod
+    def _build_prompt(protocol: Protocol) -> str:
+        """Build the single-protocol optimization prompt"""
+        return (
+            "As an expert lab protocol optimizer, analyze this protocol and provide specific optimizations:\n\n"
+            f"PROTOCOL DETAILS:\n{GeminiOptimizer._format_details(protocol)}\n\n"
+            f"TASK: Provide {_PROMPT_FOCUS}\n\n"
+            f"FORMAT EACH OPTIMIZATION AS:\n{_PROMPT_FORMAT}"
+        )
+    
+    @staticmethod
+    def _format_details(protocol: Protocol) -> str:
+        """Render the variable protocol fields of a prompt"""
+        return (
+            f"Title: {protocol.title}\n"
+            f"Description: {protocol.description}\n"
+            f"Materials: {', '.join(protocol.materials) if protocol.materials else 'Not specified'}\n"
+            f"Constraints: {protocol.constraints}"
+        )
+    
+    def _lookup(self, key: str) -> Optional[Tuple[Optimization, ...]]:
+        """Return cached optimizations for a key, or None on a miss"""
+        optimizations = self._memo.get(key)
+        if optimizations is None and self._disk_cache is not None:
+            text = self._disk_cache.get(key)
+            if text is not None:
+                optimizations = tuple(self._parse_gemini_response(text))
+                self._memo.put(key, optimizations)
+        
+        return optimizations
+    
+    def _store(self, key: str, text: str,
+               optimizations: Optional[Tuple[Optimization, ...]] = None) -> Tuple[Optimization, ...]:
+        """Cache a response once it has parsed; a response that fails to parse is not cached"""
+        if optimizations is None:
+            optimizations = tuple(self._parse_gemini_response(text))
+        self._memo.put(key, optimizations)
+        if self._disk_cache is not None:
+            self._disk_cache.set(key, text, expire=CACHE_EXPIRE)
+        
+        return optimizations
+    
+    def optimize_protocols(self, protocols: List[Protocol]) -> List[List[Optimization]]:
+        """Get optimization suggestions for several protocols, one API call per batch"""
+        results = []
+        for start in range(0, len(protocols), MAX_BATCH_SIZE):
+            results.extend(self._optimize_batch(protocols[start:start + MAX_BATCH_SIZE]))
         
-        PROTOCOL DETAILS:
-        Title: {protocol.title}
-        Description: {protocol.description}
-        Materials: {', '.join(protocol.materials) if protocol.materials else 'Not specified'}
-        Constraints: {protocol.constraints}
+        return results
+    
+    def _optimize_batch(self, protocols: List[Protocol]) -> List[List[Optimization]]:
+        """Resolve one batch, sending only the protocols missing from the cache"""
+        keys = [self._cache_key(protocol, batched=True) for protocol in protocols]
+        results = [self._lookup(key) for key in keys]
+        pending = [i for i, optimizations in enumerate(results) if optimizations is None]
+        if not pending:
+            return [list(optimizations) for optimizations in results]
         
-        TASK: Provide 3-5 specific, actionable optimizations focusing on:
-        1. Cost reduction (cheaper alternatives, volume reduction, bulk purchasing)
-        2. Time reduction (faster methods, parallel processing, automation)
-        3. Efficiency improvements (better yields, reduced errors, simplified steps)
-        4. Equipment alternatives (cheaper/more available instruments)
+        try:
+            blocks = self._generate_batch([protocols[i] for i in pending])
+        except Exception as e:
+            print(f"Warning: Gemini API error: {e}")
+            blocks = [None] * len(pending)
         
-        FORMAT EACH OPTIMIZATION AS:
-        TYPE: [Cost Reduction|Time Reduction|Efficiency|Equipment]
-        SUGGESTION: [Specific actionable recommendation]
-        SAVINGS: [Quantified benefit]
-        CONFIDENCE: [0.1-1.0 confidence score]
-        REASONING: [Brief scientific justification]
-        ---
+        # Parse protocol by protocol so a malformed block only loses its own answer
+        for i, block in zip(pending, blocks):
+            try:
+                results[i] = self._store(keys[i], block) if block is not None else ()
+            except Exception as e:
+                print(f"Warning: Gemini response error for {protocols[i].title}: {e}")
+                results[i] = ()
         
-        Be specific with numbers, brands, and techniques. Focus on practical, immediately implementable changes.
-        """
+        return [list(optimizations) for optimizations in results]
+    
+    def _generate_batch(self, protocols: List[Protocol]) -> List[Optional[str]]:
+        """Send several protocols in one prompt and return each one's answer block, or None if missing"""
+        details = "\n\n".join(
+            f"### PROTOCOL {n}\n{self._format_details(protocol)}\n###END {n}"
+            for n, protocol in enumerate(protocols, 1)
+        )
+        prompt = (
+            f"As an expert lab protocol optimizer, analyze each of the following {len(protocols)} protocols "
+            "and provide specific optimizations:\n\n"
+            f"{details}\n\n"
+            f"TASK: For EACH protocol, provide {_PROMPT_FOCUS}\n\n"
+            "START THE ANSWER FOR PROTOCOL i WITH THE LINE ===PROT i=== AND FORMAT EACH OPTIMIZATION AS:\n"
+            f"{_PROMPT_FORMAT}"
+        )
         
-        try:
-            response = requests.post(
-                f"{self.base_url}?key={self.api_key}",
-                json={
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }],
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "maxOutputTokens": 2048
-                    }
-                },
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
-            
+        text = self._generate(prompt, max_output_tokens=min(MAX_OUTPUT_TOKENS * len(protocols), MODEL_MAX_OUTPUT_TOKENS))
+        
+        # Split into [preamble, n, block, n, block, ...] and map blocks back by number
+        blocks = [None] * len(protocols)
+        parts = _BATCH_SPLIT_RE.split(text)
+        for n, block in zip(parts[1::2], parts[2::2]):
+            n = int(n) - 1
+            if 0 <= n < len(protocols):
+                blocks[n] = block
+        
+        return blocks
+    
+    @staticmethod
+    def _payload(prompt: str, max_output_tokens: int, stop_sequences: Optional[List[str]] = None) -> bytes:
+        """Encode a generateContent request body"""
+        generation_config = {
+            "temperature": 0.7,
+            "maxOutputTokens": max_output_tokens
+        }
+        if stop_sequences:
+            generation_config["stopSequences"] = stop_sequences
+        
+        return _json_dumps({
+            "contents": [{
+                "parts": [{"text": prompt}]
+            }],
+            "generationConfig": generation_config
+        })
+    
+    def _generate(self, prompt: str, max_output_tokens: int = MAX_OUTPUT_TOKENS) -> str:
+        """Send a prompt to the Gemini API and return the response text"""
+        response = self._session.post(
+            f"{self.base_url}?key={self.api_key}",
+            data=self._payload(prompt, max_output_tokens),
+            timeout=30
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"API Error: {response.status_code} - {response.text}")
+        
+        candidate = _json_loads(response.content)['candidates'][0]
+        text = candidate['content']['parts'][0]['text']
+        
+        # A response cut off at the token cap ends mid-section; keep the closed ones only
+        if candidate.get('finishReason') == 'MAX_TOKENS':
+            text = text[:text.rfind('---')] if '---' in text else ''
+        
+        return text
+    
+    def _stream(self, prompt: str, max_output_tokens: int = MAX_OUTPUT_TOKENS,
+                stop_sequences: Optional[List[str]] = None) -> Iterator[Tuple[str, Optional[str]]]:
+        """Send a prompt to the streaming Gemini endpoint and yield (text, finishReason) per event"""
+        with self._session.post(
+            f"{self.stream_url}?alt=sse&key={self.api_key}",
+            data=self._payload(prompt, max_output_tokens, stop_sequences),
+            stream=True,
+            timeout=(5, 60)
+        ) as response:
             if response.status_code != 200:
                 raise Exception(f"API Error: {response.status_code} - {response.text}")
             
-            data = response.json()
-            text = data['candidates'][0]['content']['parts'][0]['text']
-            
-            return self._parse_gemini_response(text)
-            
-        except Exception as e:
-            print(f"Warning: Gemini API error: {e}")
-            return []
+            # chunk_size=None yields each chunk as it arrives instead of waiting to fill 512-byte reads
+            for line in response.iter_lines(chunk_size=None):
+                if not line.startswith(b'data:'):
+                    continue
+                candidate = _json_loads(line[5:])['candidates'][0]
+                parts = candidate.get('content', {}).get('parts', [])
+                yield ''.join(part.get('text', '') for part in parts), candidate.get('finishReason')
+    
+    def _iter_sections(self, prompt: str) -> Iterator[str]:
+        """Stream a single-protocol prompt and yield each '---' delimited section once it closes"""
+        buffer = ''
+        finish_reason = None
+        # An empty section means the single answer is complete
+        for text, finish_reason in self._stream(prompt, stop_sequences=["---\n---"]):
+            buffer += text
+            *sections, buffer = buffer.split('---')
+            yield from sections
+        
+        # A response cut off at the token cap ends mid-section; keep the closed ones only
+        if finish_reason != 'MAX_TOKENS':
+            yield buffer
     
     def _parse_gemini_response(self, text: str) -> List[Optimization]:
         """Parse Gemini response into structured optimizations"""
         optimizations = []
-        sections = text.split('---')
-        
-        for section in sections:
-            section = section.strip()
-            if not section:
-                continue
-                
-            # Extract fields using regex
-            type_match = re.search(r'TYPE:\s*(.+)', section, re.IGNORECASE)
-            suggestion_match = re.search(r'SUGGESTION:\s*(.+)', section, re.IGNORECASE | re.DOTALL)
-            savings_match = re.search(r'SAVINGS:\s*(.+)', section, re.IGNORECASE)
-            confidence_match = re.search(r'CONFIDENCE:\s*([\d.]+)', section, re.IGNORECASE)
-            
-            if type_match and suggestion_match:
-                # Clean up suggestion text
-                suggestion_text = suggestion_match.group(1).strip()
-                suggestion_text = re.sub(r'SAVINGS:.*', '', suggestion_text, flags=re.IGNORECASE | re.DOTALL).strip()
-                
-                optimization = Optimization(
-                    type=type_match.group(1).strip(),
-                    suggestion=suggestion_text,
-                    savings=savings_match.group(1).strip() if savings_match else "Variable",
-                    confidence=float(confidence_match.group(1)) if confidence_match else 0.7,
-                    source="Gemini AI Analysis",
-                    estimated_cost_reduction=self._extract_cost_reduction(section),
-                    estimated_time_reduction=self._extract_time_reduction(section)
-                )
+        for section in text.split('---'):
+            optimization = self._parse_gemini_response_section(section)
+            if optimization:
                 optimizations.append(optimization)
         
         return optimizations[:5]  # Limit to 5 optimizations
     
-    def _extract_cost_reduction(self, text: str) -> float:
-        """Extract estimated cost reduction percentage from text"""
-        cost_patterns = [
-            r'(\d+)%.*cost.*reduction',
-            r'(\d+)%.*cheaper',
-            r'save.*(\d+)%.*cost',
-            r'reduce.*cost.*(\d+)%'
-        ]
-        
-        for pattern in cost_patterns:
-            match = re.search(pattern, text.lower())
+    def _parse_gemini_response_section(self, section: str) -> Optional[Optimization]:
+        """Parse one '---' delimited response block into an optimization"""
+        section = section.strip()
+        if not section:
+            return None
+        
+        # Extract fields using regex
+        type_match = _TYPE_RE.search(section)
+        suggestion_match = _SUG_RE.search(section)
+        savings_match = _SAV_RE.search(section)
+        confidence_match = _CONF_RE.search(section)
+        
+        if not (type_match and suggestion_match):
+            return None
+        
+        # Clean up suggestion text
+        suggestion_text = suggestion_match.group(1).strip()
+        suggestion_text = _STRIP_SAV_RE.sub('', suggestion_text).strip()
+        section_lower = section.lower()
+        
+        return Optimization(
+            type=type_match.group(1).strip(),
+            suggestion=suggestion_text,
+            savings=savings_match.group(1).strip() if savings_match else "Variable",
+            confidence=float(confidence_match.group(1)) if confidence_match else 0.7,
+            source="Gemini AI Analysis",
+            estimated_cost_reduction=self._extract_cost_reduction(section_lower),
+            estimated_time_reduction=self._extract_time_reduction(section_lower)
+        )
+    
+    def _extract_cost_reduction(self, text_lower: str) -> float:
+        """Extract estimated cost reduction percentage from lowercased text"""
+        # Every pattern needs a percentage and a cost word; skip the regexes otherwise
+        if '%' not in text_lower or ('cost' not in text_lower and 'cheap' not in text_lower):
+            return 0.0
+        for pattern in _COST_RES:
+            match = pattern.search(text_lower)
             if match:
                 return float(match.group(1)) / 100
         return 0.0
     
-    def _extract_time_reduction(self, text: str) -> float:
-        """Extract estimated time reduction percentage from text"""
-        time_patterns = [
-            r'(\d+)%.*time.*reduction',
-            r'(\d+)%.*faster',
-            r'save.*(\d+)%.*time',
-            r'reduce.*time.*(\d+)%'
-        ]
-        
-        for pattern in time_patterns:
-            match = re.search(pattern, text.lower())
+    def _extract_time_reduction(self, text_lower: str) -> float:
+        """Extract estimated time reduction percentage from lowercased text"""
+        if '%' not in text_lower or ('time' not in text_lower and 'fast' not in text_lower):
+            return 0.0
+        for pattern in _TIME_RES:
+            match = pattern.search(text_lower)
             if match:
                 return float(match.group(1)) / 100
         return 0.0
@@ -308,6 +633,10 @@ class ProtocolOptimizer:
     def __init__(self, gemini_api_key: str):
         self.db = ProtocolDatabase()
         self.gemini = GeminiOptimizer(gemini_api_key) if gemini_api_key else None
+    
+    def __del__(self):
+        if getattr(self, 'gemini', None):
+            self.gemini.close()
         
     def analyze_protocol(self, protocol: Protocol) -> Dict:
         """Analyze protocol and return optimizations"""
@@ -315,44 +644,62 @@ class ProtocolOptimizer:
         print(f"🔍 Analyzing protocol: {protocol.title}")
         print("=" * 60)
         
-        # Get database optimizations
-        db_optimizations = self.db.get_optimizations(
-            f"{protocol.title} {protocol.description} {' '.join(protocol.materials)}"
-        )
+        db_opts = self._database_optimizations(protocol)
+        if not self.gemini:
+            return self._summarize(db_opts)
         
-        # Convert to Optimization objects
-        db_opts = []
-        for opt_data in db_optimizations:
-            db_opts.append(Optimization(
-                type=opt_data['type'],
-                suggestion=opt_data['suggestion'],
-                savings=opt_data['savings'],
-                confidence=opt_data['confidence'],
-                source=opt_data['source'],
-                estimated_cost_reduction=opt_data.get('cost_reduction', 0.0),
-                estimated_time_reduction=opt_data.get('time_reduction', 0.0)
-            ))
-        
-        # Get Gemini optimizations
+        # Show each Gemini suggestion as its section arrives; the ranked report
+        # follows once the response is complete
+        print("🤖 Consulting Gemini AI...", flush=True)
         gemini_opts = []
-        if self.gemini:
-            print("🤖 Consulting Gemini AI...")
-            gemini_opts = self.gemini.optimize_protocol(protocol)
+        for opt in self.gemini.stream_protocol(protocol):
+            gemini_opts.append(opt)
+            print(f"   💡 {opt.type}: {opt.suggestion}", flush=True)
+        
+        return self._summarize(db_opts + gemini_opts)
+    
+    def analyze_protocols(self, protocols: List[Protocol]) -> List[Dict]:
+        """Analyze several protocols, batching the Gemini requests"""
+        
+        print(f"🔍 Analyzing {len(protocols)} protocols")
+        print("=" * 60)
         
-        # Combine and rank optimizations
-        all_optimizations = db_opts + gemini_opts
-        all_optimizations.sort(key=lambda x: x.confidence, reverse=True)
+        if self.gemini:
+            print("🤖 Consulting Gemini AI...", flush=True)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                fut_ai = executor.submit(self.gemini.optimize_protocols, protocols)
+                db_opts = [self._database_optimizations(protocol) for protocol in protocols]
+                gemini_opts = fut_ai.result()
+        else:
+            db_opts = [self._database_optimizations(protocol) for protocol in protocols]
+            gemini_opts = [[] for _ in protocols]
         
-        # Calculate aggregate savings
-        total_cost_reduction = min(sum(opt.estimated_cost_reduction for opt in all_optimizations), 0.8)
-        total_time_reduction = min(sum(opt.estimated_time_reduction for opt in all_optimizations), 0.9)
+        return [self._summarize(db + ai) for db, ai in zip(db_opts, gemini_opts)]
+    
+    def _database_optimizations(self, protocol: Protocol) -> List[Optimization]:
+        """Look up repository optimizations matching the protocol"""
+        return self.db.get_optimizations(protocol.search_text)
+    
+    @staticmethod
+    def _summarize(all_optimizations: List[Optimization]) -> Dict:
+        """Rank optimizations and compute aggregate savings"""
+        all_optimizations.sort(key=attrgetter('confidence'), reverse=True)
+        
+        # Accumulate aggregate savings in a single pass
+        cost = time_saved = confidence = 0.0
+        count = 0
+        for opt in all_optimizations:
+            cost += opt.estimated_cost_reduction
+            time_saved += opt.estimated_time_reduction
+            confidence += opt.confidence
+            count += 1
         
         return {
             'optimizations': all_optimizations,
-            'total_cost_reduction': total_cost_reduction,
-            'total_time_reduction': total_time_reduction,
-            'optimization_count': len(all_optimizations),
-            'average_confidence': sum(opt.confidence for opt in all_optimizations) / len(all_optimizations) if all_optimizations else 0
+            'total_cost_reduction': min(cost, 0.8),
+            'total_time_reduction': min(time_saved, 0.9),
+            'optimization_count': count,
+            'average_confidence': confidence / count if count else 0
         }
 
 class ProtocolReportGenerator:
@@ -362,31 +709,39 @@ class ProtocolReportGenerator:
     def print_results(results: Dict, protocol: Protocol):
         """Print optimization results to console"""
         
-        print(f"\n📊 OPTIMIZATION RESULTS FOR: {protocol.title}")
-        print("=" * 80)
-        
-        print(f"📈 SUMMARY:")
-        print(f"   • Optimizations Found: {results['optimization_count']}")
-        print(f"   • Estimated Cost Reduction: {results['total_cost_reduction']:.1%}")
-        print(f"   • Estimated Time Reduction: {results['total_time_reduction']:.1%}")
-        print(f"   • Average Confidence: {results['average_confidence']:.1%}")
-        
-        print(f"\n🚀 DETAILED OPTIMIZATIONS:")
-        print("-" * 80)
+        # Build the whole report first and hand it to stdout in one write
+        parts = [
+            f"\n📊 OPTIMIZATION RESULTS FOR: {protocol.title}\n",
+            "=" * 80 + "\n",
+            f"📈 SUMMARY:\n",
+            f"   • Optimizations Found: {results['optimization_count']}\n",
+            f"   • Estimated Cost Reduction: {results['total_cost_reduction']:.1%}\n",
+            f"   • Estimated Time Reduction: {results['total_time_reduction']:.1%}\n",
+            f"   • Average Confidence: {results['average_confidence']:.1%}\n",
+            f"\n🚀 DETAILED OPTIMIZATIONS:\n",
+            "-" * 80 + "\n"
+        ]
         
         for i, opt in enumerate(results['optimizations'], 1):
-            print(f"\n{i}. {opt.type.upper()}")
-            print(f"   💡 Suggestion: {opt.suggestion}")
-            print(f"   💰 Savings: {opt.savings}")
-            print(f"   🎯 Confidence: {opt.confidence:.1%}")
-            print(f"   📚 Source: {opt.source}")
-            
-            if opt.estimated_cost_reduction > 0:
-                print(f"   💵 Est. Cost Reduction: {opt.estimated_cost_reduction:.1%}")
-            if opt.estimated_time_reduction > 0:
-                print(f"   ⏱️  Est. Time Reduction: {opt.estimated_time_reduction:.1%}")
+            ProtocolReportGenerator._format_optimization(parts, i, opt)
         
-        print("\n" + "=" * 80)
+        parts.append("\n" + "=" * 80 + "\n")
+        sys.stdout.write(''.join(parts))
+        sys.stdout.flush()
+    
+    @staticmethod
+    def _format_optimization(parts: List[str], i: int, opt: Optimization):
+        """Append the report lines for one optimization to parts"""
+        parts.append(f"\n{i}. {opt.type.upper()}\n")
+        parts.append(f"   💡 Suggestion: {opt.suggestion}\n")
+        parts.append(f"   💰 Savings: {opt.savings}\n")
+        parts.append(f"   🎯 Confidence: {opt.confidence:.1%}\n")
+        parts.append(f"   📚 Source: {opt.source}\n")
+        
+        if opt.estimated_cost_reduction > 0:
+            parts.append(f"   💵 Est. Cost Reduction: {opt.estimated_cost_reduction:.1%}\n")
+        if opt.estimated_time_reduction > 0:
+            parts.append(f"   ⏱️  Est. Time Reduction: {opt.estimated_time_reduction:.1%}\n")
     
     @staticmethod
     def save_to_file(results: Dict, protocol: Protocol, filename: str = None):
@@ -423,13 +778,16 @@ class ProtocolReportGenerator:
             }
         }
         
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        with open(filename, 'wb') as f:
+            f.write(_json_dumps(data, indent=True))
         
         print(f"📄 Results saved to: {filename}")
 
 def interactive_mode():
-    """Interactive mode for protocol input"""
+    """Interactive mode for protocol input; piped stdin is read as protocol blocks"""
+    if not sys.stdin.isatty():
+        return _parse_block(sys.stdin.read()), None
+    
     print("🧪 LAB PROTOCOL OPTIMIZER")
     print("=" * 50)
     print("Enter your protocol details below:")
@@ -449,7 +807,29 @@ def interactive_mode():
     
     api_key = input("\nGemini API Key (optional, get free key from https://makersuite.google.com/app/apikey): ").strip()
     
-    return Protocol(title, description, materials, [], constraints=constraints), api_key
+    return [Protocol(title, description, materials, [], constraints=constraints)], api_key
+
+def _parse_block(data: str) -> List[Protocol]:
+    """Parse 'KEY: value' protocol blocks; each TITLE line starts a new protocol"""
+    blocks = []
+    for match in _BLOCK_RE.finditer(data):
+        key, value = match.group(1), match.group(2).strip()
+        if key == 'TITLE':
+            blocks.append({'title': value, 'description': "", 'materials': [], 'constraints': ""})
+        elif not blocks:
+            raise ValueError(f"{key} line before the first TITLE")
+        elif key == 'DESC':
+            blocks[-1]['description'] = value
+        elif key == 'MATERIAL':
+            if value:
+                blocks[-1]['materials'].append(value)
+        else:
+            blocks[-1]['constraints'] = value
+    
+    if not blocks:
+        raise ValueError("No protocols found in input (expected TITLE/DESC/MATERIAL/CONSTRAINTS lines)")
+    
+    return [Protocol(steps=[], **block) for block in blocks]
 
 def main():
     """Main application entry point"""
@@ -464,31 +844,44 @@ def main():
     
     args = parser.parse_args()
     
+    # Reports are written in one block; progress messages flush explicitly
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    
     try:
         if args.interactive or not args.title:
-            protocol, api_key = interactive_mode()
+            protocols, api_key = interactive_mode()
+            api_key = api_key or args.api_key or os.getenv('GEMINI_API_KEY')
         else:
-            protocol = Protocol(
+            protocols = [Protocol(
                 title=args.title,
                 description=args.description or "",
                 materials=args.materials or [],
                 steps=[],
                 constraints=args.constraints or ""
-            )
+            )]
             api_key = args.api_key or os.getenv('GEMINI_API_KEY')
         
         # Initialize optimizer
         optimizer = ProtocolOptimizer(api_key)
         
-        # Analyze protocol
-        results = optimizer.analyze_protocol(protocol)
-        
-        # Display results
-        ProtocolReportGenerator.print_results(results, protocol)
+        # Analyze protocols; several piped protocols share batched Gemini requests
+        if len(protocols) == 1:
+            all_results = [optimizer.analyze_protocol(protocols[0])]
+        else:
+            all_results = optimizer.analyze_protocols(protocols)
         
-        # Save if requested
-        if args.save:
-            ProtocolReportGenerator.save_to_file(results, protocol, args.save)
+        for i, (protocol, results) in enumerate(zip(protocols, all_results), 1):
+            # Display results
+            ProtocolReportGenerator.print_results(results, protocol)
+            
+            # Save if requested, numbering the files when there are several protocols
+            if args.save:
+                filename = args.save
+                if len(protocols) > 1:
+                    root, ext = os.path.splitext(args.save)
+                    filename = f"{root}_{i}{ext}"
+                ProtocolReportGenerator.save_to_file(results, protocol, filename)
         
     except KeyboardInterrupt:
         print("\n\nOperation cancelled.")
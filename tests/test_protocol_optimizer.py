@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol_optimizer import GeminiOptimizer, Protocol, _parse_block
+
+
+def test_parse_block_empty_fields_do_not_consume_next_line():
+    protocols = _parse_block(
+        "TITLE: PCR run\n"
+        "DESC:\n"
+        "MATERIAL: taq\n"
+        "MATERIAL: primers\n"
+        "MATERIAL:\n"
+        "CONSTRAINTS:\n"
+        "TITLE: second\n"
+    )
+
+    assert [p.title for p in protocols] == ["PCR run", "second"]
+    assert protocols[0].description == ""
+    assert protocols[0].materials == ["taq", "primers"]
+    assert protocols[0].constraints == ""
+
+
+def test_parse_block_multiple_blocks():
+    protocols = _parse_block(
+        "TITLE: PCR run\r\n"
+        "DESC: amplify gene\r\n"
+        "MATERIAL: Taq\r\n"
+        "CONSTRAINTS: under $50\r\n"
+        "\r\n"
+        "TITLE: Western blot\r\n"
+        "DESC: detect protein\r\n"
+        "MATERIAL: PVDF membrane\r\n"
+        "MATERIAL: antibody\r\n"
+    )
+
+    assert len(protocols) == 2
+    first, second = protocols
+    assert (first.title, first.description, first.materials, first.constraints) == (
+        "PCR run", "amplify gene", ["Taq"], "under $50"
+    )
+    assert (second.title, second.description, second.materials, second.constraints) == (
+        "Western blot", "detect protein", ["PVDF membrane", "antibody"], ""
+    )
+    assert second.search_text == "western blot detect protein pvdf membrane antibody"
+
+
+@pytest.mark.parametrize("data", ["", "DESC: no title first\nTITLE: late\n"])
+def test_parse_block_rejects_input_without_leading_title(data):
+    with pytest.raises(ValueError):
+        _parse_block(data)
+
+
+def _gemini(monkeypatch, *responses):
+    gemini = GeminiOptimizer("test-key", cache_dir=None)
+    replies = iter(responses)
+    monkeypatch.setattr(gemini, "_generate", lambda prompt, **kw: next(replies))
+    return gemini
+
+
+def test_optimize_protocols_keeps_good_blocks_when_one_fails_to_parse(monkeypatch):
+    gemini = _gemini(monkeypatch, (
+        "===PROT 1===\n"
+        "TYPE: Cost Reduction\nSUGGESTION: Halve the volume\nSAVINGS: 50% reagent cost\nCONFIDENCE: 0.8\n---\n"
+        "===PROT 2===\n"
+        "TYPE: Time Reduction\nSUGGESTION: Use a fast polymerase\nSAVINGS: 75% cycle time\nCONFIDENCE: 0.8.\n---\n"
+    ))
+    protocols = [Protocol("A", "", [], []), Protocol("B", "", [], [])]
+
+    first, second = gemini.optimize_protocols(protocols)
+
+    assert [opt.suggestion for opt in first] == ["Halve the volume"]
+    assert second == []
+
+
+class _DictCache(dict):
+    def set(self, key, value, expire=None):
+        self[key] = value
+
+
+def _streaming_gemini(monkeypatch, *responses):
+    gemini = GeminiOptimizer("test-key", cache_dir=None)
+    replies = iter(responses)
+    monkeypatch.setattr(gemini, "_stream", lambda prompt, **kw: iter(next(replies)))
+    return gemini
+
+
+def test_optimize_protocol_does_not_cache_unparsable_responses(monkeypatch):
+    gemini = _streaming_gemini(
+        monkeypatch,
+        [("TYPE: Cost Reduction\nSUGGESTION: Halve the volume\nSAVINGS: 50%\nCONFIDENCE: 0.8.\n", "STOP")],
+        [("TYPE: Cost Reduction\nSUGGESTION: Halve the volume\nSAVINGS: 50%\nCONFIDENCE: 0.8\n", "STOP")],
+    )
+    gemini._disk_cache = _DictCache()
+    protocol = Protocol("A", "", [], [])
+
+    assert gemini.optimize_protocol(protocol) == []
+    assert not gemini._disk_cache
+
+    assert [opt.confidence for opt in gemini.optimize_protocol(protocol)] == [0.8]
+    assert len(gemini._disk_cache) == 1
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, data):
+        self.content = json.dumps(data)
+
+
+def test_generate_drops_the_section_cut_off_at_max_tokens(monkeypatch):
+    gemini = GeminiOptimizer("test-key", cache_dir=None)
+    text = (
+        "TYPE: Cost Reduction\nSUGGESTION: Halve the volume\nSAVINGS: 50%\n---\n"
+        "TYPE: Time Reduction\nSUGGESTION: Use a fast"
+    )
+    monkeypatch.setattr(gemini._session, "post", lambda *a, **kw: _Response({
+        "candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": "MAX_TOKENS"}]
+    }))
+
+    optimizations = gemini._parse_gemini_response(gemini._generate("prompt"))
+
+    assert [opt.suggestion for opt in optimizations] == ["Halve the volume"]
+
+
+def test_stream_protocol_yields_sections_as_they_close(monkeypatch):
+    gemini = _streaming_gemini(monkeypatch, [
+        ("TYPE: Cost Reduction\nSUGGESTION: Halve the volume\nSAVINGS: 50%\n--", None),
+        ("-\nTYPE: Time Reduction\nSUGGESTION: Use a fast", "MAX_TOKENS"),
+    ])
+    gemini._disk_cache = _DictCache()
+    protocol = Protocol("A", "", [], [])
+
+    stream = gemini.stream_protocol(protocol)
+    assert next(stream).suggestion == "Halve the volume"
+    assert list(stream) == []
+
+    assert [opt.suggestion for opt in gemini.optimize_protocol(protocol)] == ["Halve the volume"]
+    assert len(gemini._disk_cache) == 1